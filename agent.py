@@ -6,21 +6,33 @@ Shows students exactly what happens at each step
 """
 
 import os
-import json
+import sys
+import gzip
+import time
+import threading
 import requests
-from typing import List, Dict, Any, Optional
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
 from dotenv import load_dotenv
-from datetime import datetime
 
 from config import (
     MODEL_ID,
     TEMPERATURE,
     MAX_TOKENS,
     MAX_ITERATIONS,
+    MAX_TOOL_WORKERS,
+    MAX_TOOL_RESULT_CHARS,
+    EARLY_TOOL_DISPATCH,
+    MAX_CONTEXT_TOKENS,
+    HISTORY_TOKEN_BUDGET,
+    COMPRESS_REQUESTS,
+    COMPRESS_MIN_BYTES,
     SYSTEM_PROMPT,
     SHOW_USAGE_STATS,
     SHOW_TOOL_EXECUTION
 )
+from json_utils import to_json, to_json_bytes, from_json
 from tools import (
     get_calculator_tool_spec,
     execute_calculator,
@@ -35,28 +47,75 @@ MODEL_API_URL = os.getenv("MODEL_API_URL")
 MODEL_API_KEY = os.getenv("MODEL_API_KEY")
 
 
+# Tool specifications are static - build and encode them once
+_TOOLS = [
+    get_calculator_tool_spec(),
+    get_retrieve_tool_spec()
+]
+_TOOLS_FRAGMENT = b',"tools":' + to_json_bytes(_TOOLS) + b',"tool_choice":{"auto":{}}'
+
+
+# Last formatted second, so sub-second log lines skip localtime()
+_last_second: Dict[int, str] = {}
+
+
+def _timestamp() -> str:
+    """Current local time as HH:MM:SS.mmm"""
+    seconds, millis = divmod(time.time_ns() // 1_000_000, 1000)
+    
+    hms = _last_second.get(seconds)
+    if hms is None:
+        t = time.localtime(seconds)
+        hms = f"{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}"
+        _last_second.clear()
+        _last_second[seconds] = hms
+    
+    return f"{hms}.{millis:03d}"
+
+
+def print_lines(lines: List[str]):
+    """Print several lines with a single write to stdout"""
+    sys.stdout.write("\n".join(lines) + "\n")
+
+
 def print_section(title: str, symbol: str = "="):
     """Print a formatted section header"""
     width = 80
-    print(f"\n{symbol * width}")
-    print(f"{title.center(width)}")
-    print(f"{symbol * width}")
+    print_lines([
+        f"\n{symbol * width}",
+        f"{title.center(width)}",
+        f"{symbol * width}"
+    ])
 
 
 def print_json(data: Any, title: str = None, max_length: int = None):
     """Pretty print JSON data"""
+    lines = []
     if title:
-        print(f"\n📄 {title}:")
-        print("-" * 80)
+        lines.append(f"\n📄 {title}:")
+        lines.append("-" * 80)
     
-    json_str = json.dumps(data, indent=2, ensure_ascii=False)
+    json_str = to_json(data)
     
     if max_length and len(json_str) > max_length:
-        print(json_str[:max_length])
-        print(f"\n... (truncated, {len(json_str) - max_length} more characters)")
+        lines.append(json_str[:max_length])
+        lines.append(f"\n... (truncated, {len(json_str) - max_length} more characters)")
     else:
-        print(json_str)
-    print("-" * 80)
+        lines.append(json_str)
+    lines.append("-" * 80)
+    
+    print_lines(lines)
+
+
+class BedrockAPIError(requests.RequestException):
+    """Model API refused the request because the monthly limit is exceeded"""
+
+
+def _is_user_turn(message: Dict) -> bool:
+    """True for a user message that starts a turn (not a tool result message)"""
+    return message.get("role") == "user" and not any(
+        "toolResult" in block for block in message.get("content", [])
+    )
 
 
 class EducationalRAGAgent:
@@ -75,13 +134,47 @@ class EducationalRAGAgent:
             )
         
         self.conversation_history: List[Dict] = []
+        # Encoded copy of each history message, so only new ones get serialized
+        self._history_bytes: List[bytes] = []
+        # Guards both history lists; tools run on worker threads
+        self._history_lock = threading.Lock()
         self.total_cost = 0.0
         self.verbose = verbose
         self.request_count = 0
+        
+        # Reuse one keep-alive connection across iterations (no TLS handshake per call)
+        self._session = requests.Session()
+        self._session.mount(
+            "https://",
+            HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        )
+        
+        # Tools requested in one response run in parallel
+        self._tool_executor = ThreadPoolExecutor(max_workers=MAX_TOOL_WORKERS)
+        self._pending_tools: Dict[str, Future] = {}
+        # Successful calculator results by canonical input, cleared on reset
+        # (retrieval has its own TTL cache in tools/retrieve.py)
+        self._tool_cache: Dict[bytes, Dict[str, Any]] = {}
+        
+        # Request parts that never change, built once
+        self._static_payload = {
+            "model_id": MODEL_ID,
+            "system": [{"text": SYSTEM_PROMPT}],
+            "inference_config": {
+                "maxTokens": MAX_TOKENS,
+                "temperature": TEMPERATURE
+            }
+        }
+        self._payload_prefix = to_json_bytes(self._static_payload)[:-1]  # Without closing "}"
+        self._headers = {
+            "Content-Type": "application/json",
+            "x-api-key": MODEL_API_KEY
+        }
+        self._gzip_headers = {**self._headers, "Content-Encoding": "gzip"}
     
     def _log(self, message: str, level: str = "INFO"):
         """Log a message with timestamp"""
-        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+        timestamp = _timestamp()
         prefix = {
             "INFO": "ℹ️ ",
             "SUCCESS": "✅",
@@ -91,33 +184,85 @@ class EducationalRAGAgent:
             "DATA": "📊"
         }.get(level, "  ")
         
-        print(f"[{timestamp}] {prefix} {message}")
+        sys.stdout.write(f"[{timestamp}] {prefix} {message}\n")
+    
+    def _append_history(self, message: Dict):
+        """Add a message to the history and cache its encoded form"""
+        encoded = to_json_bytes(message)
+        with self._history_lock:
+            self.conversation_history.append(message)
+            self._history_bytes.append(encoded)
+    
+    def _history_tokens(self) -> int:
+        """Approximate token count of the conversation (~4 bytes per token)"""
+        return sum(map(len, self._history_bytes)) // 4
+    
+    def _trim_history(self):
+        """Drop the oldest turns while the history is over its token budget"""
+        budget = int(MAX_CONTEXT_TOKENS * HISTORY_TOKEN_BUDGET)
+        dropped = 0
+        
+        with self._history_lock:
+            while self._history_tokens() > budget:
+                # Cut at the next user turn so toolUse/toolResult pairs stay together
+                next_turn = next(
+                    (
+                        i for i, message in enumerate(self.conversation_history)
+                        if i > 0 and _is_user_turn(message)
+                    ),
+                    None
+                )
+                if next_turn is None:
+                    break  # Only the current turn is left
+                
+                del self.conversation_history[:next_turn]
+                del self._history_bytes[:next_turn]
+                dropped += next_turn
+        
+        if dropped:
+            self._log(f"Trimmed {dropped} old message(s) to fit {budget} tokens", "DATA")
     
     def _call_model(
         self,
         messages: List[Dict],
         tools: Optional[List[Dict]] = None
-    ) -> Dict[str, Any]:
-        """Call Bedrock model via API Gateway with detailed logging"""
+    ) -> Tuple[Dict[str, Any], List[Dict]]:
+        """
+        Call Bedrock model via API Gateway with detailed logging
+        
+        Returns:
+            Tuple of (full response, toolUse blocks of the response message)
+        """
         
         self.request_count += 1
+        verbose = self.verbose  # Read once; checked inside the block loop
         
         print_section(f"🌐 API REQUEST #{self.request_count}", "=")
         
-        # Build payload
-        payload = {
-            "model_id": MODEL_ID,
-            "messages": messages,
-            "system": [{"text": SYSTEM_PROMPT}],
-            "inference_config": {
-                "maxTokens": MAX_TOKENS,
-                "temperature": TEMPERATURE
-            }
-        }
+        # Build payload from the precomputed static prefix
+        body = self._payload_prefix
         
-        if tools:
-            payload["tools"] = tools
-            payload["tool_choice"] = {"auto": {}}
+        if tools is _TOOLS:
+            body += _TOOLS_FRAGMENT
+        elif tools:
+            body += b',"tools":' + to_json_bytes(tools) + b',"tool_choice":{"auto":{}}'
+        
+        # Reuse the cached encoding of the history; only new messages were serialized.
+        # No snapshot copy needed: the history is only appended between model calls.
+        if messages is self.conversation_history and len(self._history_bytes) == len(messages):
+            encoded_messages = self._history_bytes
+        else:
+            encoded_messages = [to_json_bytes(message) for message in messages]
+        
+        body += b',"messages":[' + b",".join(encoded_messages) + b"]}"
+        
+        # Large bodies are mostly repetitive JSON - gzip them for the wire
+        headers = self._headers
+        if COMPRESS_REQUESTS and len(body) >= COMPRESS_MIN_BYTES:
+            raw_size = len(body)
+            body = gzip.compress(body, compresslevel=1)
+            headers = self._gzip_headers
+            self._log(f"Compressed request: {raw_size} -> {len(body)} bytes", "API")
         
         # Show what we're sending
         self._log(f"Endpoint: {MODEL_API_URL}", "API")
@@ -125,7 +270,7 @@ class EducationalRAGAgent:
         self._log(f"Temperature: {TEMPERATURE}", "API")
         self._log(f"Max Tokens: {MAX_TOKENS}", "API")
         
-        if self.verbose:
+        if verbose:
             print_json(
                 {"messages": messages[-1] if messages else None},
                 "Last Message Being Sent",
@@ -133,26 +278,20 @@ class EducationalRAGAgent:
             )
             
             if tools:
-                print(f"\n🔧 Tools Available: {len(tools)}")
-                for tool in tools:
-                    print(f"   - {tool['toolSpec']['name']}")
-        
-        # Prepare request
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-key": MODEL_API_KEY
-        }
+                print_lines(
+                    [f"\n🔧 Tools Available: {len(tools)}"]
+                    + [f"   - {tool['toolSpec']['name']}" for tool in tools]
+                )
         
         self._log("Sending request to Bedrock...", "API")
         
         try:
             # Make request
-            import time
             start_time = time.time()
             
-            response = requests.post(
+            response = self._session.post(
                 MODEL_API_URL,
-                json=payload,
+                data=body,
                 headers=headers,
                 timeout=60
             )
@@ -161,20 +300,47 @@ class EducationalRAGAgent:
             
             # Check response
             response.raise_for_status()
-            data = response.json()
+            data = from_json(response.content)
             
             self._log(f"Response received in {elapsed:.2f}s", "SUCCESS")
             
+            # Walk the content blocks once: collect tool calls and the log lines
+            message_content = data.get("output", {}).get("message", {}).get("content", [])
+            tool_uses = []
+            lines = ["\n📝 Response Content Blocks:"]
+            
+            for i, block in enumerate(message_content, 1):
+                if "text" in block:
+                    if verbose:
+                        lines.append(f"\n   Block {i} [TEXT]:")
+                        text = block["text"]
+                        if len(text) > 200:
+                            lines.append(f"   {text[:200]}...")
+                        else:
+                            lines.append(f"   {text}")
+                
+                elif "toolUse" in block:
+                    tool_use = block["toolUse"]
+                    tool_uses.append(tool_use)
+                    if verbose:
+                        lines.append(f"\n   Block {i} [TOOL USE]:")
+                        lines.append(f"   Tool: {tool_use['name']}")
+                        lines.append(f"   Tool Use ID: {tool_use['toolUseId']}")
+                        lines.append(f"   Input: {to_json(tool_use.get('input', {}), indent=False)}")
+            
+            # Start requested tools now so they run while the response is logged
+            if EARLY_TOOL_DISPATCH and data.get("stop_reason") == "tool_use":
+                self._dispatch_tools(tool_uses)
+            
             # Show response details
             print_section("📥 API RESPONSE", "-")
             
-            if self.verbose:
+            if verbose:
                 print_json(data, "Full Response", max_length=1000)
             
             # Extract key info
             stop_reason = data.get("stop_reason")
             usage = data.get("usage", {})
-            output = data.get("output", {})
             
             self._log(f"Stop Reason: {stop_reason}", "DATA")
             self._log(
@@ -198,67 +364,57 @@ class EducationalRAGAgent:
                 )
             
             # Show message content
-            message_content = output.get("message", {}).get("content", [])
-            
-            print("\n📝 Response Content Blocks:")
-            for i, block in enumerate(message_content, 1):
-                if "text" in block:
-                    print(f"\n   Block {i} [TEXT]:")
-                    text = block["text"]
-                    if len(text) > 200:
-                        print(f"   {text[:200]}...")
-                    else:
-                        print(f"   {text}")
-                
-                elif "toolUse" in block:
-                    tool_use = block["toolUse"]
-                    print(f"\n   Block {i} [TOOL USE]:")
-                    print(f"   Tool: {tool_use['name']}")
-                    print(f"   Tool Use ID: {tool_use['toolUseId']}")
-                    print(f"   Input: {json.dumps(tool_use.get('input', {}), ensure_ascii=False)}")
+            if verbose:
+                print_lines(lines)
+            else:
+                self._log(f"Response Content: {len(message_content)} block(s)", "DATA")
             
-            return data
+            return data, tool_uses
             
         except requests.exceptions.HTTPError as e:
             self._log(f"HTTP Error: {e.response.status_code}", "ERROR")
-            if self.verbose:
+            if verbose:
                 print(f"Response: {e.response.text}")
             
             # Check for monthly limit error
             if e.response.status_code == 429:
                 try:
                     error_data = e.response.json()
-                    if "Monthly limit exceeded" in error_data.get("error", ""):
-                        print_section("⚠️  MONTHLY LIMIT EXCEEDED", "!")
-                        print(f"\n   Used: ${error_data.get('monthly_usage', 0):.2f}")
-                        print(f"   Limit: ${error_data.get('monthly_limit', 0):.2f}")
-                        print(f"   Please wait until next month or contact support.\n")
+                    limit_exceeded = "Monthly limit exceeded" in error_data.get("error", "")
                 except:
-                    pass
+                    limit_exceeded = False
+                
+                if limit_exceeded:
+                    print_section("⚠️  MONTHLY LIMIT EXCEEDED", "!")
+                    print(f"\n   Used: ${error_data.get('monthly_usage', 0):.2f}")
+                    print(f"   Limit: ${error_data.get('monthly_limit', 0):.2f}")
+                    print(f"   Please wait until next month or contact support.\n")
+                    raise BedrockAPIError(
+                        "Monthly limit exceeded",
+                        response=e.response
+                    ) from e
             
-            raise Exception(f"Model API error: {e.response.status_code}")
+            raise
         except Exception as e:
             self._log(f"Error: {str(e)}", "ERROR")
-            raise Exception(f"Failed to call model: {str(e)}")
+            raise
     
-    def _execute_tool(self, tool_use: Dict) -> str:
-        """Execute a tool and return result with detailed logging"""
+    def _run_tool(self, tool_use: Dict) -> Dict[str, Any]:
+        """Route a tool call to its implementation"""
         
         tool_name = tool_use.get("name")
         tool_input = tool_use.get("input", {})
         
-        print_section(f"🔧 TOOL EXECUTION: {tool_name}", "=")
-        
-        self._log(f"Tool: {tool_name}", "TOOL")
-        self._log(f"Tool Use ID: {tool_use.get('toolUseId')}", "TOOL")
-        
-        print_json(tool_input, "Tool Input")
-        
-        # Route to appropriate tool
-        self._log("Executing tool...", "TOOL")
-        
         if tool_name == "calculator":
+            # Identical expressions within a session reuse the earlier result
+            cache_key = to_json_bytes(tool_input, sort_keys=True)
+            cached = self._tool_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
             result = execute_calculator(**tool_input)
+            if result.get("status") == "success":
+                self._tool_cache[cache_key] = result
         
         elif tool_name == "retrieve_documents":
             result = retrieve_documents(**tool_input)
@@ -269,12 +425,60 @@ class EducationalRAGAgent:
                 "error": f"Unknown tool: {tool_name}"
             }
         
+        return result
+    
+    def _submit_tool(self, tool_use: Dict) -> Future:
+        """Start a tool in the background and return its future"""
+        return self._tool_executor.submit(self._run_tool, tool_use)
+    
+    def _dispatch_tools(self, tool_uses: List[Dict]):
+        """Submit toolUse blocks to the tool executor ahead of _execute_tool"""
+        for tool_use in tool_uses:
+            self._pending_tools[tool_use["toolUseId"]] = self._submit_tool(tool_use)
+        
+        if tool_uses:
+            self._log(f"Started {len(tool_uses)} tool(s) early", "TOOL")
+    
+    def _cancel_pending_tools(self):
+        """Drop futures left behind when an earlier turn failed after dispatch"""
+        for future in self._pending_tools.values():
+            future.cancel()
+        self._pending_tools.clear()
+    
+    def _execute_tool(self, tool_use: Dict, future: Optional[Future] = None) -> str:
+        """
+        Execute a tool and return result with detailed logging
+        
+        Args:
+            tool_use: toolUse block from the model response
+            future: Already running tool call (see _submit_tool), if any
+        """
+        
+        tool_name = tool_use.get("name")
+        tool_input = tool_use.get("input", {})
+        verbose = self.verbose
+        
+        print_section(f"🔧 TOOL EXECUTION: {tool_name}", "=")
+        
+        self._log(f"Tool: {tool_name}", "TOOL")
+        self._log(f"Tool Use ID: {tool_use.get('toolUseId')}", "TOOL")
+        
+        if verbose:
+            print_json(tool_input, "Tool Input")
+        
+        # Route to appropriate tool
+        self._log("Executing tool...", "TOOL")
+        
+        if future is None:
+            future = self._submit_tool(tool_use)
+        result = future.result()
+        
         # Show result
         print_section("📤 TOOL RESULT", "-")
         
         self._log(f"Status: {result.get('status', 'unknown')}", "DATA")
         
-        if self.verbose:
+        if verbose:
             print_json(result, "Full Tool Result", max_length=2000)
         else:
             # Show summary
@@ -284,7 +488,17 @@ class EducationalRAGAgent:
             elif tool_name == "calculator":
                 print(f"   Result: {result.get('result', 'N/A')}")
         
-        result_text = json.dumps(result, indent=2, ensure_ascii=False)
+        # Compact JSON - the model doesn't need indentation
+        result_text = to_json(result, indent=False)
+        
+        # Cap what goes into the history - it is re-sent on every later iteration
+        if len(result_text) > MAX_TOOL_RESULT_CHARS:
+            truncated = len(result_text) - MAX_TOOL_RESULT_CHARS
+            result_text = (
+                result_text[:MAX_TOOL_RESULT_CHARS]
+                + f"...[truncated {truncated} characters]"
+            )
+            self._log(f"Result truncated by {truncated} characters", "DATA")
         
         return result_text
     
@@ -301,9 +515,10 @@ class EducationalRAGAgent:
         
         print_section(f"💬 NEW CHAT REQUEST", "═")
         self._log(f"User: {user_message}", "INFO")
+        self._cancel_pending_tools()
         
         # Add user message
-        self.conversation_history.append({
+        self._append_history({
             "role": "user",
             "content": [{"text": user_message}]
         })
@@ -311,10 +526,7 @@ class EducationalRAGAgent:
         self._log(f"Conversation history: {len(self.conversation_history)} messages", "DATA")
         
         # Tool specifications
-        tools = [
-            get_calculator_tool_spec(),
-            get_retrieve_tool_spec()
-        ]
+        tools = _TOOLS
         
         iteration = 0
         request_cost = 0.0
@@ -325,7 +537,7 @@ class EducationalRAGAgent:
             print_section(f"🔄 ITERATION {iteration}/{MAX_ITERATIONS}", "─")
             
             # Call model
-            response = self._call_model(
+            response, tool_uses = self._call_model(
                 messages=self.conversation_history,
                 tools=tools
             )
@@ -342,10 +554,11 @@ class EducationalRAGAgent:
             stop_reason = response.get("stop_reason")
             
             # Add to history
-            self.conversation_history.append({
+            self._append_history({
                 "role": "assistant",
                 "content": message_content
             })
+            self._trim_history()
             
             # Handle tool use
             if stop_reason == "tool_use":
@@ -353,23 +566,28 @@ class EducationalRAGAgent:
                 
                 tool_results = []
                 
-                for block in message_content:
-                    if "toolUse" in block:
-                        tool_use = block["toolUse"]
-                        result_text = self._execute_tool(tool_use)
-                        
-                        tool_results.append({
-                            "toolResult": {
-                                "toolUseId": tool_use["toolUseId"],
-                                "content": [{"text": result_text}]
-                            }
-                        })
+                # Start all tools at once (unless already started), then log results in order
+                futures = [
+                    self._pending_tools.pop(tool_use["toolUseId"], None)
+                    or self._submit_tool(tool_use)
+                    for tool_use in tool_uses
+                ]
+                
+                for tool_use, future in zip(tool_uses, futures):
+                    result_text = self._execute_tool(tool_use, future)
+                    
+                    tool_results.append({
+                        "toolResult": {
+                            "toolUseId": tool_use["toolUseId"],
+                            "content": [{"text": result_text}]
+                        }
+                    })
                 
                 # Add tool results
                 print_section("📨 SENDING TOOL RESULTS BACK TO MODEL", "-")
                 self._log(f"Sending {len(tool_results)} tool result(s)", "INFO")
                 
-                self.conversation_history.append({
+                self._append_history({
                     "role": "user",
                     "content": tool_results
                 })
@@ -412,7 +630,11 @@ class EducationalRAGAgent:
         self._log(f"Cleared {len(self.conversation_history)} messages", "INFO")
         self._log(f"Session cost was: ${self.total_cost:.6f}", "DATA")
         
-        self.conversation_history = []
+        with self._history_lock:
+            self.conversation_history = []
+            self._history_bytes = []
+        self._cancel_pending_tools()
+        self._tool_cache.clear()
         self.request_count = 0
         # Don't reset total_cost to track session total
 
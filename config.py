@@ -22,6 +22,17 @@ MAX_TOKENS = 4096
 # ==============================================================================
 
 MAX_ITERATIONS = 3  # Maximum tool use iterations before stopping
+MAX_TOOL_WORKERS = 8  # Tool calls from one response executed in parallel
+EARLY_TOOL_DISPATCH = True  # Start tools as soon as the model response arrives
+MAX_TOOL_RESULT_CHARS = 16000  # Longer tool results are truncated before going into history
+
+# Conversation history limits
+MAX_CONTEXT_TOKENS = 200000  # Context window of the model
+HISTORY_TOKEN_BUDGET = 0.6   # Share of the context window the history may use
+
+# Request compression (API Gateway must accept Content-Encoding: gzip)
+COMPRESS_REQUESTS = False
+COMPRESS_MIN_BYTES = 16384  # Only compress request bodies at least this large
 
 
 # ==============================================================================
@@ -32,10 +43,22 @@ MAX_ITERATIONS = 3  # Maximum tool use iterations before stopping
 DEFAULT_K = 10
 DEFAULT_SEARCH_TYPE = "HYBRID"  # Options: HYBRID, SEMANTIC, KEYWORD
 DEFAULT_COMPANY_FILTER = None   # Set to company name to filter, or None for all
+ADAPTIVE_K = True  # Without an explicit k, use 3/5/DEFAULT_K results by query length
 
 # Retrieval limits
 MIN_K = 1
 MAX_K = 50
+MAX_PARALLEL_COMPANIES = 8  # Concurrent KB calls when several companies are requested
+
+# Retrieval cache (repeated queries skip the KB API)
+RETRIEVAL_CACHE_SIZE = 256  # Cached queries, 0 disables the cache
+RETRIEVAL_CACHE_TTL = 3600  # Seconds before a cached result expires
+RETRIEVAL_CACHE_PATH = "kb_cache.sqlite"  # SQLite file (relative to this directory) that survives restarts, None = memory only
+
+# Local BM25 pre-filter over previously retrieved chunks (HYBRID searches only)
+KEYWORD_PREFILTER = False      # Answer from the local index when it is confident
+KEYWORD_MIN_SCORE = 8.0        # BM25 score the best local hit needs to skip the KB API
+KEYWORD_INDEX_MAX_DOCS = 2000  # Chunks kept in the local index per company filter
 
 
 # ==============================================================================
@@ -0,0 +1,40 @@
+# json_utils.py
+"""
+JSON helpers shared by the agent and the tools
+Uses orjson when installed, stdlib json otherwise
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to stdlib json
+    orjson = None
+
+
+def to_json(data: Any, indent: bool = True) -> str:
+    """Serialize data to a JSON string (indented for display by default)"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option).decode("utf-8")
+    return json.dumps(data, indent=2 if indent else None, ensure_ascii=False)
+
+
+def to_json_bytes(data: Any, sort_keys: bool = False) -> bytes:
+    """Serialize data to compact UTF-8 JSON bytes (sorted keys give a stable cache key)"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(data, option=option)
+    return json.dumps(data, ensure_ascii=False, sort_keys=sort_keys).encode("utf-8")
+
+
+def from_json(raw: bytes) -> Any:
+    """Parse a JSON response body straight from bytes"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
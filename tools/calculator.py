@@ -3,41 +3,140 @@
 Calculator tool using SymPy for mathematical operations
 """
 
-from typing import Dict, Any
-import sympy as sp
+import ast
+import math
+from functools import lru_cache
+from typing import Dict, Any, Optional
 
 from config import DEFAULT_PRECISION, DEFAULT_CALC_MODE
 
 
-def get_calculator_tool_spec() -> Dict[str, Any]:
-    """Return tool specification for Bedrock Converse API"""
-    return {
-        "toolSpec": {
-            "name": "calculator",
-            "description": "Advanced calculator for precise mathematical operations. Use this for any calculations instead of doing them yourself.",
-            "inputSchema": {
-                "json": {
-                    "type": "object",
-                    "properties": {
-                        "expression": {
-                            "type": "string",
-                            "description": "Mathematical expression to calculate (e.g., '2 + 2 * 3', 'sin(pi/2)', 'sqrt(16)')"
-                        },
-                        "mode": {
-                            "type": "string",
-                            "enum": ["evaluate", "solve"],
-                            "description": "Mode: 'evaluate' to calculate, 'solve' to solve equation (default: evaluate)"
-                        },
-                        "precision": {
-                            "type": "integer",
-                            "description": f"Number of decimal places (default: {DEFAULT_PRECISION})"
-                        }
+# Names the fast path understands (same meaning as in SymPy). pi, E and the
+# trig/exp/log functions stay on SymPy, which keeps sin(pi) an exact 0
+_FAST_NAMESPACE = {
+    "sqrt": math.sqrt,
+    "floor": math.floor,
+    "ceiling": math.ceil,
+    "abs": abs,
+    "Abs": abs
+}
+# eval globals: the whitelist plus an empty builtins table
+_FAST_GLOBALS = {**_FAST_NAMESPACE, "__builtins__": {}}
+_FAST_BINOPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod)
+_FAST_UNARYOPS = (ast.UAdd, ast.USub)
+
+
+def _is_numeric_node(node: ast.AST) -> bool:
+    """Check that an expression tree only uses numbers, operators and known names"""
+    if isinstance(node, ast.Constant):
+        return type(node.value) in (int, float)
+    if isinstance(node, ast.BinOp):
+        return (
+            isinstance(node.op, _FAST_BINOPS)
+            and _is_numeric_node(node.left)
+            and _is_numeric_node(node.right)
+        )
+    if isinstance(node, ast.UnaryOp):
+        return isinstance(node.op, _FAST_UNARYOPS) and _is_numeric_node(node.operand)
+    if isinstance(node, ast.Name):
+        return node.id in _FAST_NAMESPACE
+    if isinstance(node, ast.Call):
+        return (
+            isinstance(node.func, ast.Name)
+            and node.func.id in _FAST_NAMESPACE
+            and not node.keywords
+            and all(_is_numeric_node(arg) for arg in node.args)
+        )
+    return False
+
+
+class _FloatConstants(ast.NodeTransformer):
+    """Turn integer literals into floats so huge powers overflow instead of hanging"""
+    
+    def visit_Constant(self, node: ast.Constant) -> ast.Constant:
+        return ast.copy_location(ast.Constant(float(node.value)), node)
+
+
+@lru_cache(maxsize=1024)
+def _compile_numeric(expr_str: str):
+    """Compile a pure-numeric expression, or return None if SymPy is needed"""
+    try:
+        tree = ast.parse(expr_str, mode="eval")
+        if not _is_numeric_node(tree.body):
+            return None
+        tree = ast.fix_missing_locations(_FloatConstants().visit(tree))
+        return compile(tree, "<calculator>", "eval")
+    except (SyntaxError, ValueError, OverflowError):
+        return None
+
+
+def _fast_eval(expr_str: str) -> Optional[float]:
+    """Evaluate plain arithmetic with the math module, None if not possible"""
+    code = _compile_numeric(expr_str)
+    if code is None:
+        return None
+    
+    try:
+        value = eval(code, _FAST_GLOBALS)
+    except (ArithmeticError, ValueError, TypeError):
+        return None  # Let SymPy produce the error message
+    
+    if not isinstance(value, (int, float)) or not math.isfinite(value):
+        return None  # Complex or infinite result
+    return float(value)
+
+
+_sp = None
+
+
+def _sympy():
+    """Import SymPy on first use - it takes hundreds of ms and plain arithmetic never needs it"""
+    global _sp
+    if _sp is None:
+        import sympy
+        _sp = sympy
+    return _sp
+
+
+@lru_cache(maxsize=1024)
+def _parse(expr_str: str):
+    """Parse an expression with SymPy (cached - parsing dominates simple calls)"""
+    return _sympy().sympify(expr_str, evaluate=True)
+
+
+# Static tool specification, built once at import
+_CALCULATOR_TOOL_SPEC = {
+    "toolSpec": {
+        "name": "calculator",
+        "description": "Advanced calculator for precise mathematical operations. Use this for any calculations instead of doing them yourself.",
+        "inputSchema": {
+            "json": {
+                "type": "object",
+                "properties": {
+                    "expression": {
+                        "type": "string",
+                        "description": "Mathematical expression to calculate (e.g., '2 + 2 * 3', 'sin(pi/2)', 'sqrt(16)')"
                     },
-                    "required": ["expression"]
-                }
+                    "mode": {
+                        "type": "string",
+                        "enum": ["evaluate", "solve"],
+                        "description": "Mode: 'evaluate' to calculate, 'solve' to solve equation (default: evaluate)"
+                    },
+                    "precision": {
+                        "type": "integer",
+                        "description": f"Number of decimal places (default: {DEFAULT_PRECISION})"
+                    }
+                },
+                "required": ["expression"]
             }
         }
     }
+}
+
+
+def get_calculator_tool_spec() -> Dict[str, Any]:
+    """Return tool specification for Bedrock Converse API"""
+    return _CALCULATOR_TOOL_SPEC
 
 
 def execute_calculator(
@@ -59,14 +158,20 @@ def execute_calculator(
     try:
         # Parse expression
         expr_str = expression.replace("^", "**")
-        expr = sp.sympify(expr_str, evaluate=True)
         
-        # Substitute constants
-        if expr.has(sp.pi) or expr.has(sp.E):
-            expr = expr.subs({
-                sp.pi: sp.N(sp.pi, 50),
-                sp.E: sp.N(sp.E, 50)
-            })
+        # Fast path: plain arithmetic doesn't need SymPy
+        if mode != "solve":
+            value = _fast_eval(expr_str)
+            if value is not None:
+                return {
+                    "status": "success",
+                    "operation": "evaluate",
+                    "expression": expression,
+                    "result": str(float(f"{value:.{max(int(precision), 1)}g}"))
+                }
+        
+        sp = _sympy()
+        expr = _parse(expr_str)
         
         # Execute based on mode
         if mode == "solve":
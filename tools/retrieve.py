@@ -4,8 +4,18 @@ Knowledge Base retrieval tool using API Gateway
 """
 
 import os
+import re
+import math
+import time
+import heapq
+import sqlite3
+import threading
 import requests
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import Counter, OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
 from dotenv import load_dotenv
 
 from config import (
@@ -13,8 +23,18 @@ from config import (
     DEFAULT_SEARCH_TYPE,
     DEFAULT_COMPANY_FILTER,
     MIN_K,
-    MAX_K
+    MAX_K,
+    MAX_PARALLEL_COMPANIES,
+    ADAPTIVE_K,
+    VERBOSE_MODE,
+    RETRIEVAL_CACHE_SIZE,
+    RETRIEVAL_CACHE_TTL,
+    RETRIEVAL_CACHE_PATH,
+    KEYWORD_PREFILTER,
+    KEYWORD_MIN_SCORE,
+    KEYWORD_INDEX_MAX_DOCS
 )
+from json_utils import to_json_bytes, from_json
 
 # Load environment
 load_dotenv()
@@ -22,56 +42,287 @@ load_dotenv()
 KB_API_URL = os.getenv("KB_API_URL")
 KB_API_KEY = os.getenv("KB_API_KEY")
 
+_HEADERS = {
+    "Content-Type": "application/json",
+    "x-api-key": KB_API_KEY
+}
 
-def get_retrieve_tool_spec() -> Dict[str, Any]:
-    """Return tool specification for Bedrock Converse API"""
-    return {
-        "toolSpec": {
-            "name": "retrieve_documents",
-            "description": "Retrieve relevant documents from the knowledge base. Use this to find information from uploaded documents.",
-            "inputSchema": {
-                "json": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "Search query - what to find in the documents"
-                        },
-                        "k": {
-                            "type": "integer",
-                            "description": f"Number of results to return ({MIN_K}-{MAX_K}, default: {DEFAULT_K})"
-                        },
-                        "search_type": {
-                            "type": "string",
-                            "enum": ["HYBRID", "SEMANTIC", "KEYWORD"],
-                            "description": f"Search type (default: {DEFAULT_SEARCH_TYPE})"
-                        },
-                        "company_name": {
-                            "type": "string",
-                            "description": "Filter by specific company name (optional)"
-                        }
+# Shared keep-alive connection pool for all KB calls.
+# Retrieval is read-only, so retrying a POST on gateway errors is safe.
+# Timeouts and connection errors are not retried, so they still surface as-is.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=20,
+        pool_maxsize=20,
+        max_retries=Retry(
+            total=2,
+            connect=False,
+            read=False,
+            other=False,
+            backoff_factor=0.2,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=["POST"],
+            raise_on_status=False
+        )
+    )
+)
+
+
+class _RetrievalCache:
+    """LRU cache of retrieval results with a time-to-live, optionally backed by SQLite"""
+    
+    def __init__(self, max_size: int, ttl: float, path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None  # Opened on first use
+        self._entries: OrderedDict = OrderedDict()  # key -> (stored_at, result)
+        self._lock = threading.Lock()  # Tools may run on several threads
+    
+    def _open(self):
+        """Open the SQLite store and load its unexpired entries (lock held)"""
+        try:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, payload BLOB, ts REAL)"
+            )
+            self._db.execute("DELETE FROM cache WHERE ts < ?", (time.time() - self.ttl,))
+            self._db.commit()
+            
+            rows = self._db.execute(
+                "SELECT key, payload, ts FROM cache ORDER BY ts DESC LIMIT ?",
+                (self.max_size,)
+            ).fetchall()
+            for key, payload, stored_at in reversed(rows):
+                self._entries[tuple(from_json(key))] = (stored_at, from_json(payload))
+        except sqlite3.Error:
+            self.path = None  # Keep working as a memory-only cache
+            self._db = None
+    
+    def _persist(self, sql: str, params: Tuple):
+        """Run a write against the SQLite store, if there is one (lock held)"""
+        if self._db is None:
+            return
+        try:
+            self._db.execute(sql, params)
+            self._db.commit()
+        except sqlite3.Error:
+            pass  # The in-memory cache stays correct either way
+    
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        """Return a fresh cached result, or None"""
+        with self._lock:
+            if self.path and self._db is None and self.max_size > 0:
+                self._open()
+            
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            
+            stored_at, result = entry
+            if time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                self._persist("DELETE FROM cache WHERE key = ?", (to_json_bytes(key).decode("utf-8"),))
+                return None
+            
+            self._entries.move_to_end(key)
+            return result
+    
+    def put(self, key: Tuple, result: Dict[str, Any]):
+        """Store a result, evicting the least recently used entries"""
+        if self.max_size <= 0:
+            return
+        
+        with self._lock:
+            if self.path and self._db is None:
+                self._open()
+            
+            stored_at = time.time()
+            self._entries[key] = (stored_at, result)
+            self._entries.move_to_end(key)
+            self._persist(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                (to_json_bytes(key).decode("utf-8"), to_json_bytes(result), stored_at)
+            )
+            
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                self._persist("DELETE FROM cache WHERE key = ?", (to_json_bytes(evicted).decode("utf-8"),))
+
+
+# A relative cache path lives in the project directory, not wherever the agent starts
+_CACHE_PATH = RETRIEVAL_CACHE_PATH and os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    RETRIEVAL_CACHE_PATH
+)
+_cache = _RetrievalCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL, _CACHE_PATH)
+
+
+def _normalize_query(query: str) -> str:
+    """Normalize case, whitespace and trailing punctuation for cache lookups"""
+    return " ".join(query.casefold().split()).rstrip("?!. ")
+
+
+# Reciprocal rank fusion constant (standard value from the RRF paper)
+_RRF_K = 60
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens (works for Hebrew and English)"""
+    return _TOKEN_RE.findall(text.casefold())
+
+
+class _KeywordIndex:
+    """In-memory BM25 index over chunks returned by earlier retrievals"""
+    
+    def __init__(self, max_docs: int, k1: float = 1.5, b: float = 0.75):
+        self.max_docs = max_docs
+        self.k1 = k1
+        self.b = b
+        self._docs: List[Dict[str, Any]] = []
+        self._term_freqs: List[Counter] = []
+        self._doc_lengths: List[int] = []
+        self._doc_freq: Counter = Counter()
+        self._seen_texts = set()
+        self._lock = threading.Lock()
+    
+    def add(self, results: List[Dict[str, Any]]):
+        """Index new chunks until the index is full"""
+        with self._lock:
+            for result in results:
+                text = result.get("text", "")
+                if not text or text in self._seen_texts:
+                    continue
+                if len(self._docs) >= self.max_docs:
+                    break
+                
+                term_freq = Counter(_tokenize(text))
+                self._seen_texts.add(text)
+                self._docs.append(result)
+                self._term_freqs.append(term_freq)
+                self._doc_lengths.append(sum(term_freq.values()))
+                self._doc_freq.update(term_freq.keys())
+    
+    def search(self, query: str, n: int) -> List[Tuple[float, Dict[str, Any]]]:
+        """Return up to n (score, chunk) pairs with a positive BM25 score"""
+        with self._lock:
+            doc_count = len(self._docs)
+            if not doc_count:
+                return []
+            
+            avg_length = sum(self._doc_lengths) / doc_count
+            idf = {
+                term: math.log((doc_count - self._doc_freq[term] + 0.5) / (self._doc_freq[term] + 0.5) + 1)
+                for term in set(_tokenize(query))
+                if term in self._doc_freq
+            }
+            
+            scored = []
+            for doc, term_freq, length in zip(self._docs, self._term_freqs, self._doc_lengths):
+                norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                score = sum(
+                    weight * term_freq[term] * (self.k1 + 1) / (term_freq[term] + norm)
+                    for term, weight in idf.items()
+                    if term in term_freq
+                )
+                if score > 0:
+                    scored.append((score, doc))
+        
+        return heapq.nlargest(n, scored, key=lambda pair: pair[0])
+
+
+_keyword_indexes: Dict[Optional[str], _KeywordIndex] = {}
+
+
+def _keyword_index(company_name: Optional[str]) -> _KeywordIndex:
+    """Keyword index for one company filter (None = all companies)"""
+    index = _keyword_indexes.get(company_name)
+    if index is None:
+        index = _keyword_indexes.setdefault(
+            company_name, _KeywordIndex(KEYWORD_INDEX_MAX_DOCS)
+        )
+    return index
+
+
+def _pick_k(query: str) -> int:
+    """Choose the number of results from query length - short queries need fewer chunks"""
+    words = len(query.split())
+    if words < 6:
+        return min(3, DEFAULT_K)
+    if words < 12:
+        return min(5, DEFAULT_K)
+    return DEFAULT_K
+
+
+# Static tool specification, built once at import
+_RETRIEVE_TOOL_SPEC = {
+    "toolSpec": {
+        "name": "retrieve_documents",
+        "description": "Retrieve relevant documents from the knowledge base. Use this to find information from uploaded documents.",
+        "inputSchema": {
+            "json": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Search query - what to find in the documents"
                     },
-                    "required": ["query"]
-                }
+                    "k": {
+                        "type": "integer",
+                        "description": (
+                            f"Number of results to return ({MIN_K}-{MAX_K}, default: "
+                            + ("chosen from query length" if ADAPTIVE_K else str(DEFAULT_K))
+                            + ")"
+                        )
+                    },
+                    "search_type": {
+                        "type": "string",
+                        "enum": ["HYBRID", "SEMANTIC", "KEYWORD"],
+                        "description": f"Search type (default: {DEFAULT_SEARCH_TYPE})"
+                    },
+                    "company_name": {
+                        "type": "string",
+                        "description": "Filter by specific company name (optional)"
+                    },
+                    "company_names": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Search several companies in one call; results are merged by rank (optional)"
+                    }
+                },
+                "required": ["query"]
             }
         }
     }
+}
+
+
+def get_retrieve_tool_spec() -> Dict[str, Any]:
+    """Return tool specification for Bedrock Converse API"""
+    return _RETRIEVE_TOOL_SPEC
 
 
 def retrieve_documents(
     query: str,
-    k: int = DEFAULT_K,
+    k: Optional[int] = None,
     search_type: str = DEFAULT_SEARCH_TYPE,
-    company_name: Optional[str] = DEFAULT_COMPANY_FILTER
+    company_name: Optional[str] = DEFAULT_COMPANY_FILTER,
+    company_names: Optional[List[str]] = None
 ) -> Dict[str, Any]:
     """
     Retrieve documents from knowledge base
     
     Args:
         query: Search query
-        k: Number of results
+        k: Number of results (chosen from the query when not given)
         search_type: HYBRID, SEMANTIC, or KEYWORD
         company_name: Optional company filter
+        company_names: Optional list of companies, searched in parallel
         
     Returns:
         Dict with status and results
@@ -83,11 +334,68 @@ def retrieve_documents(
         }
     
     # Validate and normalize inputs
+    if k is None:
+        k = _pick_k(query) if ADAPTIVE_K else DEFAULT_K
+        if VERBOSE_MODE:
+            print(f"   Adaptive k: {k}")
     k = max(MIN_K, min(k, MAX_K))
     search_type = search_type.upper()
     if search_type not in ["HYBRID", "SEMANTIC", "KEYWORD"]:
         search_type = DEFAULT_SEARCH_TYPE
     
+    if isinstance(company_names, str):
+        company_names = [company_names]  # The model may send a bare string
+    elif company_names is not None and not isinstance(company_names, list):
+        return {
+            "status": "error",
+            "error": "company_names must be a list of company names"
+        }
+    companies = list(dict.fromkeys(c for c in (company_names or []) if c))
+    if len(companies) > 1:
+        return _retrieve_many(query, k, search_type, companies)
+    if companies:
+        company_name = companies[0]
+    
+    return _retrieve(query, k, search_type, company_name)
+
+
+def _retrieve(
+    query: str,
+    k: int,
+    search_type: str,
+    company_name: Optional[str]
+) -> Dict[str, Any]:
+    """Retrieve for one company filter - skips validation, callers pass checked inputs"""
+    # Reuse results of an equivalent earlier query
+    cache_key = (_normalize_query(query), k, search_type, company_name)
+    cached = _cache.get(cache_key)
+    if cached is not None:
+        return {**cached, "query": query}
+    
+    # Exact-term queries are often answered by chunks we have already seen
+    if KEYWORD_PREFILTER and search_type == "HYBRID":
+        hits = _keyword_index(company_name).search(query, k)
+        if hits and hits[0][0] >= KEYWORD_MIN_SCORE:
+            results = [
+                {
+                    "rank": idx,
+                    "text": doc.get("text", ""),
+                    "bm25_score": round(score, 4),  # Unbounded, not on the KB 0-1 scale
+                    "metadata": doc.get("metadata", {})
+                }
+                for idx, (score, doc) in enumerate(hits, 1)
+            ]
+            return {
+                "status": "success",
+                "query": query,
+                "search_type": search_type,
+                "k": k,
+                "company_filter": company_name,
+                "source": "keyword_index",
+                "results_count": len(results),
+                "results": results
+            }
+    
     # Build request
     payload = {
         "query": query,
@@ -98,33 +406,10 @@ def retrieve_documents(
     if company_name:
         payload["company_name"] = company_name
     
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": KB_API_KEY
-    }
-    
     try:
-        response = requests.post(
-            KB_API_URL,
-            json=payload,
-            headers=headers,
-            timeout=30
-        )
+        results = _do_request(payload)
         
-        response.raise_for_status()
-        data = response.json()
-        
-        # Format results
-        results = []
-        for idx, result in enumerate(data.get("results", []), 1):
-            results.append({
-                "rank": idx,
-                "text": result.get("text", ""),
-                "score": result.get("score"),
-                "metadata": result.get("metadata", {})
-            })
-        
-        return {
+        result = {
             "status": "success",
             "query": query,
             "search_type": search_type,
@@ -133,6 +418,12 @@ def retrieve_documents(
             "results_count": len(results),
             "results": results
         }
+        _cache.put(cache_key, result)
+        
+        if KEYWORD_PREFILTER:
+            _keyword_index(company_name).add(results)
+        
+        return result
         
     except requests.exceptions.Timeout:
         return {
@@ -148,4 +439,82 @@ def retrieve_documents(
         return {
             "status": "error",
             "error": str(e)
-        }
\ No newline at end of file
+        }
+
+
+def _do_request(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Send a prepared payload to the KB API and return ranked results
+    
+    No input validation - callers pass an already validated payload.
+    Raises requests exceptions on network or HTTP errors.
+    """
+    response = _SESSION.post(
+        KB_API_URL,
+        data=to_json_bytes(payload),
+        headers=_HEADERS,
+        timeout=30
+    )
+    
+    response.raise_for_status()
+    data = from_json(response.content)
+    
+    # Rank the freshly parsed result dicts in place instead of copying them
+    results = data.get("results", [])
+    for idx, result in enumerate(results, 1):
+        result["rank"] = idx
+    
+    return results
+
+
+def _retrieve_many(
+    query: str,
+    k: int,
+    search_type: str,
+    companies: List[str]
+) -> Dict[str, Any]:
+    """Query several companies in parallel and fuse the rankings with RRF"""
+    workers = min(MAX_PARALLEL_COMPANIES, len(companies))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        parts = list(executor.map(
+            lambda company: _retrieve(query, k, search_type, company),
+            companies
+        ))
+    
+    errors = {
+        company: part.get("error")
+        for company, part in zip(companies, parts)
+        if part.get("status") != "success"
+    }
+    if len(errors) == len(companies):
+        return {
+            "status": "error",
+            "error": "; ".join(f"{company}: {error}" for company, error in errors.items())
+        }
+    
+    # Reciprocal rank fusion: score = sum of 1 / (RRF_K + rank) over company rankings
+    fused: Dict[str, List] = {}
+    for part in parts:
+        for result in part.get("results", []):
+            entry = fused.setdefault(result.get("text", ""), [0.0, result])
+            entry[0] += 1 / (_RRF_K + result["rank"])
+    
+    top = heapq.nlargest(k, fused.values(), key=lambda entry: entry[0])
+    results = [
+        {**result, "rank": idx, "rrf_score": round(score, 6)}
+        for idx, (score, result) in enumerate(top, 1)
+    ]
+    
+    response = {
+        "status": "success",
+        "query": query,
+        "search_type": search_type,
+        "k": k,
+        "company_filter": companies,
+        "results_count": len(results),
+        "results": results
+    }
+    if errors:
+        response["errors"] = errors
+    
+    return response
\ No newline at end of file